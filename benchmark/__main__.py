@@ -1,48 +1,32 @@
-# -*- coding: future_fstrings -*-
 # -*- coding: utf-8 -*-
-from __future__ import unicode_literals
-
 import argparse
 import gc
 import sys
-from numbers import Number
-from collections import Set, Mapping, deque
+from collections import deque
 from datetime import datetime
-
-try: # Python 2
-    zero_depth_bases = (basestring, Number, xrange, bytearray)
-    iteritems = 'iteritems'
-except NameError: # Python 3
-    zero_depth_bases = (str, bytes, Number, range, bytearray)
-    iteritems = 'items'
+from types import ModuleType, FunctionType
 
 from merklelib import MerkleTree, beautify
 
 
+# shared objects that should not be counted towards the size
+_excluded_types = (type, ModuleType, FunctionType)
+
+
 # Courtesy of Aaron Hall
 # https://stackoverflow.com/questions/449560/how-do-i-determine-the-size-of-an-object-in-python
 def getsize(obj_0):
-  """Recursively iterate to sum size of object & members."""
-  _seen_ids = set()
-  def inner(obj):
-    obj_id = id(obj)
-    if obj_id in _seen_ids:
-      return 0
-    _seen_ids.add(obj_id)
-    size = sys.getsizeof(obj)
-    if isinstance(obj, zero_depth_bases):
-      pass # bypass remaining control flow and return
-    elif isinstance(obj, (tuple, list, Set, deque)):
-      size += sum(sys.getsizeof(i) for i in obj)
-    elif isinstance(obj, Mapping) or hasattr(obj, iteritems):
-      size += sum(inner(k) + inner(v) for k, v in getattr(obj, iteritems)())
-    # Check for custom object instances - may subclass above too
-    if hasattr(obj, '__dict__'):
-      size += inner(vars(obj))
-    if hasattr(obj, '__slots__'): # can have __slots__ with __dict__
-      size += sum(inner(getattr(obj, s)) for s in obj.__slots__ if hasattr(obj, s))
-    return size
-  return inner(obj_0)
+  """Sum size of object & members by traversing its referents breadth-first."""
+  _seen_ids, size = set(), 0
+  queue = deque([obj_0])
+  while queue:
+    obj = queue.popleft()
+    if isinstance(obj, _excluded_types) or id(obj) in _seen_ids:
+      continue
+    _seen_ids.add(id(obj))
+    size += sys.getsizeof(obj)
+    queue.extend(gc.get_referents(obj))
+  return size
 
 
 def _get_seconds(start):
@@ -86,16 +70,20 @@ def main():
   start, end = int(args.size), int(args.additional)
   count = start + end
 
+  # convert every leaf to bytes once up front, so the timed loops
+  # measure hashing rather than int -> str -> bytes conversions
+  leaves = [value.to_bytes(8, 'little') for value in range(count)]
+
   start_t = datetime.now()
 
-  tree = MerkleTree(value for value in range(start))
+  tree = MerkleTree(leaves[:start])
 
   print(f'Building: {_get_seconds(start_t)} seconds.')
   start_t = datetime.now()
 
   # appending
-  for v in range(start, start + end):
-    tree.append(v)
+  for leaf in leaves[start:]:
+    tree.append(leaf)
 
   print(f'Appending: {_get_seconds(start_t)} seconds.')
   print(f'Tree size: {getsize(tree)}')
@@ -108,9 +96,9 @@ def main():
 
   total, start_t = 0.0, datetime.now()
   max_t = min_t = None
-  for leaf in range(count):
+  for leaf in leaves:
     cycle_t = datetime.now()
-    proof = tree.get_proof(leaf)
+    proof = tree.get_proof_by_value(leaf)
     if not tree.verify_leaf_inclusion(leaf, proof):
       exit(f'Failed audit proof: {leaf}')
     seconds = _get_seconds(cycle_t)
@@ -133,7 +121,7 @@ def main():
   max_t = min_t = None
   for limit in range(1, count):
     cycle_t = datetime.now()
-    test = MerkleTree([value for value in range(limit)])
+    test = MerkleTree(leaves[:limit])
     if tree < test:
       exit(f'Failed consistency proof: {limit}')
     seconds = _get_seconds(cycle_t)
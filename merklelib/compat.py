@@ -1,17 +1,11 @@
-import sys
+bytes_types = (bytes, bytearray)
 
-_ver = sys.version_info
+builtin_str = str
+str = str
+bytes = bytes
 
-is_py2 = _ver[0] == 2
-is_py3 = _ver[0] == 3
-
-if is_py2:
-    bytes = str
-    str = unicode
-    basestring = basestring
-    bytes_types = (bytes, bytearray)
-elif is_py3:
-    builtin_str = str
-    str = str
-    bytes = bytes
-    bytes_types = (bytes, bytearray)
+# optional, a faster hash function for trees that do not need sha256
+try:
+    import blake3
+except ImportError:
+    blake3 = None
@@ -1,11 +1,10 @@
-# -*- coding: future_fstrings -*-
 # -*- coding: utf-8 -*-
-from __future__ import unicode_literals
+import io
 
 from merklelib import utils
 from merklelib.merkle import MerkleNode, MerkleTree, _BaseNode
 
-from anytree import AnyNode, RenderTree
+from anytree import AnyNode
 from anytree.exporter import DotExporter, JsonExporter
 
 
@@ -17,10 +16,10 @@ def _get_printable_tree(tree):
     raise TypeError(
       f'Expected MerkleTree or MerkleNode, got {type(tree)}'
     )
-  root = tree
-  if isinstance(tree, MerkleTree):
-    root = tree._root
   get_hash = lambda n: utils.to_hex(n.hash)
+  if isinstance(tree, MerkleTree):
+    return _get_printable_levels(list(tree._iter_levels()))
+  root = tree
   parent = AnyNode(name=get_hash(root))
   queue = [(root, parent)]
   while len(queue) > 0:
@@ -34,6 +33,18 @@ def _get_printable_tree(tree):
   return parent
 
 
+def _get_printable_levels(levels):
+  # the parent of node i is the (i >> 1)th node on the level above
+  nodes = [AnyNode(name=utils.to_hex(hash)) for hash in levels[-1]]
+  root = nodes[0]
+  for level in reversed(levels[:-1]):
+    nodes = [
+      AnyNode(name=utils.to_hex(hash), parent=nodes[index >> 1])
+      for index, hash in enumerate(level)
+    ]
+  return root
+
+
 def export(tree, filename, ext='json', **kwargs):
   parent = _get_printable_tree(tree)
   if ext == 'json':
@@ -49,6 +60,35 @@ def jsonify(tree, **kwargs):
 
 
 def beautify(tree):
-  parent = _get_printable_tree(tree)
-  for pre, fill, node in RenderTree(parent):
-    print(f'{pre}{node.name}')
+  if not isinstance(tree, (MerkleTree, MerkleNode)):
+    raise TypeError(
+      f'Expected MerkleTree or MerkleNode, got {type(tree)}'
+    )
+  if isinstance(tree, MerkleTree):
+    levels = list(tree._iter_levels())[::-1]
+    if len(levels[0]) == 0:
+      return
+    get_name = lambda node: utils.to_hex(levels[node[0]][node[1]])
+    get_children = lambda node: [
+      (node[0] + 1, i) for i in (node[1] << 1, (node[1] << 1) + 1)
+      if node[0] + 1 < len(levels) and i < len(levels[node[0] + 1])
+    ]
+    root = (0, 0)
+  else:
+    get_name = lambda node: utils.to_hex(node.hash)
+    get_children = lambda node: [
+      child for child in (node.left, node.right)
+      if isinstance(child, _BaseNode)
+    ]
+    root = tree
+  # print straight from the tree, the same layout RenderTree produces
+  print(get_name(root))
+  stack = []
+  def push(children, prefix):
+    for index in range(len(children) - 1, -1, -1):
+      stack.append((children[index], prefix, index == len(children) - 1))
+  push(get_children(root), '')
+  while len(stack) > 0:
+    node, prefix, is_last = stack.pop()
+    print(f'{prefix}{"└── " if is_last else "├── "}{get_name(node)}')
+    push(get_children(node), prefix + ('    ' if is_last else '│   '))
@@ -1,4 +1,3 @@
-# -*- coding: future_fstrings -*-
 # -*- coding: utf-8 -*-
 
 """Merkle trees.
@@ -30,36 +29,63 @@ Copyright: (c) 2018 by Vasyl Paliy.
 License: MIT, see LICENSE for more details.
 """
 
-from __future__ import unicode_literals
-from __future__ import print_function
-from __future__ import with_statement
-
 import hashlib
 import collections
-import abc
-import six
+import contextlib
 import functools
-import math
 import time
 
 from merklelib import utils
+from merklelib.compat import bytes_types, blake3
 
 # used to indicate whether a leaf (or node) is the left or right child
 # or unknown yet
 LEFT, RIGHT, UNKNOWN = tuple(range(3))
 
 
-# used as a "duplicate" node in the Merkle tree
-# utilizing this light-weight object helps to keep the tree balanced
-# (in other words, the number of nodes should be power of 2)
-_empty = object()
+# hashlib resolves sha256 to OpenSSL (which uses SHA-NI/ARMv8 instructions)
+# when it is available and to a builtin implementation otherwise
+_sha256 = hashlib.sha256
 
 
 # hash function which is supplied when the user
 # does not provide his/her hashing mechanism
+# returns the raw digest, so no hex encoding/decoding is needed
 def _default_hash(value):
+  # Hasher.hashfunc hands this function to users as is,
+  # the hot paths go through _leaf_state/_node_state instead
+  value = utils.to_string(value)
+  return _sha256(value).digest()
+
+_default_hash._binary = True
+
+
+def _blake3_hash(value):
+  # handed to users by Hasher.hashfunc as well, see _default_hash
   value = utils.to_string(value)
-  return hashlib.sha256(value).hexdigest()
+  return blake3.blake3(value).digest()
+
+_blake3_hash._binary = True
+
+
+# the CPU cannot change while the process runs, read its flags once
+@functools.lru_cache(maxsize=None)
+def _has_cpu_flag(flag):
+  # only Linux exposes the CPU flags in a readable way
+  try:
+    with open('/proc/cpuinfo') as fp:
+      return any(
+        flag in line.split()
+        for line in fp if line.startswith('flags')
+      )
+  except OSError:
+    return False
+
+
+# sha256 states that have already absorbed the leaf/node prefix,
+# the batch hashers copy them instead of re-hashing the prefix
+_leaf_state = _sha256(b'\x00')
+_node_state = _sha256(b'\x01')
 
 
 def _hash_from_hex(func):
@@ -80,6 +106,12 @@ def _hash_from_hex(func):
   return _wrapper
 
 
+def _returns_digest(func):
+  # only functions that declare it with _binary, such as _default_hash,
+  # skip the hex decoding, user functions are never called up front
+  return bool(getattr(func, '_binary', False))
+
+
 class Hasher(object):
   """Merkle hasher that appends additional bytes to leaves and nodes before hashing.
 
@@ -96,25 +128,117 @@ class Hasher(object):
       raise TypeError(f'Expected callable, got {type(hashfunc)}')
     self.hashfunc = hashfunc
 
+  @classmethod
+  def from_algorithm(cls, algorithm='sha256'):
+    """Creates a Hasher for one of the built-in hash functions.
+
+    :param algorithm: 'sha256', 'blake3' or 'auto'. The latter is an opt-in
+      that picks blake3 if the blake3 package is installed and falls back
+      to sha256, so its roots depend on the machine.
+      Note: trees built with different algorithms have different roots.
+    :return: a Hasher instance.
+    """
+    if algorithm == 'auto':
+      algorithm = 'sha256' if blake3 is None else 'blake3'
+    if algorithm == 'sha256':
+      return cls(_default_hash)
+    if algorithm == 'blake3':
+      if blake3 is None:
+        raise ValueError('blake3 is not installed.')
+      return cls(_blake3_hash)
+    raise ValueError(f'Unknown algorithm: {algorithm}')
+
+  @staticmethod
+  def available_accelerations():
+    """Reports the hashing accelerations available on this machine.
+
+    :return: a dict, 'openssl' tells if sha256 comes from OpenSSL,
+      'sha_ni' if the CPU has SHA extensions (used by OpenSSL for sha256),
+      'blake3' if blake3 can be used.
+    """
+    return {
+      'openssl': _sha256.__name__.startswith('openssl_'),
+      'sha_ni': _has_cpu_flag('sha_ni'),
+      'blake3': blake3 is not None
+    }
+
   def hash_leaf(self, data):
-    data = b'\x00' + utils.to_string(data)
-    return self._hashfunc(data)
+    # hash values and other bytes need no coercion
+    if type(data) is not bytes:
+      data = utils.to_string(data)
+    if self._hashfunc is _default_hash:
+      state = _leaf_state.copy()
+      state.update(data)
+      return state.digest()
+    return self._hashfunc(b'\x00' + data)
+
+  def hash_leaves(self, data):
+    """Hashes a batch of leaves in a single pass.
+
+    :param data: an iterable of items (or hash values) to be hashed as leaves.
+    :return: a list with the hash value of every leaf, in order.
+    """
+    # bind everything locally, this loop is hot for large trees
+    hashfunc, to_string = self._hashfunc, utils.to_string
+    if hashfunc is _default_hash:
+      # the default digest is raw bytes already,
+      # so hashlib can be called without the wrappers
+      copy, hashes = _leaf_state.copy, []
+      for item in data:
+        if type(item) is not bytes:
+          item = to_string(item)
+        state = copy()
+        state.update(item)
+        hashes.append(state.digest())
+      return hashes
+    return [
+      hashfunc(b'\x00' + (item if type(item) is bytes else to_string(item)))
+      for item in data
+    ]
 
   def hash_children(self, left, right):
-    data = b'\x01' + left + right
-    return self._hashfunc(data)
+    if self._hashfunc is _default_hash:
+      # feed the children to a copy of the prefixed state,
+      # no concatenated copy of them is needed
+      state = _node_state.copy()
+      state.update(left)
+      state.update(right)
+      return state.digest()
+    return self._hashfunc(b'\x01' + left + right)
+
+  def hash_children_batch(self, pairs):
+    """Hashes a batch of sibling pairs in a single pass.
+
+    :param pairs: an iterable of (left, right) hash value tuples.
+    :return: a list with the hash value of every parent, in order.
+    """
+    hashfunc = self._hashfunc
+    if hashfunc is _default_hash:
+      copy, hashes = _node_state.copy, []
+      for l, r in pairs:
+        state = copy()
+        state.update(l)
+        state.update(r)
+        hashes.append(state.digest())
+      return hashes
+    return [hashfunc(b'\x01' + l + r) for l, r in pairs]
 
   @property
   def hashfunc(self):
-    return self._hashfunc
+    return self._hexfunc
 
   @hashfunc.setter
   def hashfunc(self, hashfunc):
-    self._hashfunc = _hash_from_hex(hashfunc)
+    self._hexfunc = _hash_from_hex(hashfunc)
+    # functions marked as returning raw digests need no hex decoding,
+    # so they are called directly on the hot paths
+    self._hashfunc = self._hexfunc
+    if _returns_digest(hashfunc):
+      self._hashfunc = hashfunc
 
   def __repr__(self):
     classname = self.__class__.__name__
-    hashfunc = self._hashfunc.__wrapped__
+    hashfunc = self._hexfunc.__wrapped__
     return f'{classname}({hashfunc})'
 
   def __str__(self):
@@ -129,45 +253,56 @@ def _pairwise(iterable):
 
 def _get_hash(obj):
   if isinstance(obj, _BaseNode):
-    return utils.to_string(obj.hash)
+    return obj.hash
+  # hash values are already bytes, only coerce raw objects
+  if isinstance(obj, bytes_types):
+    return obj
   return utils.to_string(obj)
 
 
-def _concat(hasher, *nodes):
+def _target_hashes(hasher, target):
+  """Yields the hash values a verification target may stand for.
+
+  :param hasher: Hasher object for hashing the target as a leaf.
+  :param target: a leaf which is represented by either a real object
+    (int, str, etc.) or the hash value of that object.
+  """
+  # only hash values (and nodes) can be folded as they are,
+  # other objects can never match before being hashed as leaves
+  if isinstance(target, (_BaseNode,) + bytes_types):
+    yield _get_hash(target)
+  # try again if the user forgot to hash the target
+  yield hasher.hash_leaf(target)
+
+
+def _concat(hasher, x, y):
   """Concatenate the hashes of two nodes using the provided hasher object.
 
   :param hasher: Hasher object for hashing nodes.
-  :param nodes: nodes that should be concatenated.
-    Usually, descendants of _BaseNode, hexadecimal strings, _empty nodes or mixed.
+  :param x, y: nodes that should be concatenated.
+    Usually, descendants of _BaseNode, hexadecimal strings or mixed.
   :return: the hash value produced by concatenation of provided nodes.
   """
-  def __concat(x, y):
-    # we can't concatenate _empty nodes
-    # return the hash value of the not _empty object
-    if (x is _empty) or (y is _empty):
-      return x.hash if y is _empty else y.hash
-    children = (_get_hash(x), _get_hash(y))
-    # x.type == RIGHT or y.type == LEFT indicates y + x
-    if isinstance(x, _BaseNode) and x.type == RIGHT:
-      return hasher.hash_children(*children[::-1])
-    elif isinstance(y, _BaseNode) and y.type == LEFT:
-      return hasher.hash_children(*children[::-1])
-    return hasher.hash_children(*children)
-  return functools.reduce(__concat, nodes)
-
-
-def _climb_to(node, level):
-  """Traverses the Merkle Tree to a certain level.
-
-  :param node: marks the starting point from which we begin climbing up the tree.
-  :param level: an integer that indicates how many levels we need to climb.
-  :return: ancestor of the provided node object at the specified level of the tree.
-     None if the starting node doesn't have ancestors at the requested level.
+  if isinstance(x, _BaseNode) and isinstance(y, _BaseNode):
+    return x.combine_with(y, hasher)
+  left, right = _get_hash(x), _get_hash(y)
+  # x.type == RIGHT or y.type == LEFT indicates y + x
+  if isinstance(x, _BaseNode) and x.type == RIGHT:
+    return hasher.hash_children(right, left)
+  elif isinstance(y, _BaseNode) and y.type == LEFT:
+    return hasher.hash_children(right, left)
+  return hasher.hash_children(left, right)
+
+
+def _hash_level(hasher, level):
+  """Hashes every pair of siblings on a level to produce the level above it.
+
+  :param hasher: Hasher object for hashing nodes.
+  :param level: a list with the hash values of the nodes on the same level.
+  :return: a list with the hash values of their parents.
+    A trailing node without a sibling is left out, it ends up on the spine.
   """
-  while (level > 0) and node:
-    level -= 1
-    node = node.parent
-  return node
+  return hasher.hash_children_batch(_pairwise(level))
 
 
 def verify_tree_consistency(new_tree, old_root, old_size):
@@ -190,49 +325,90 @@ def verify_tree_consistency(new_tree, old_root, old_size):
   if new_size < old_size:
     return False
 
-  # assuming both hashes are hexadecimal strings
+  # assuming the old hash is either a digest or a hexadecimal string
   old_root = utils.from_hex(old_root)
-  new_root = utils.from_hex(new_tree.merkle_root)
+  # no need to hex encode the new root only to decode it back
+  new_root = new_tree._root_hash
 
   # if the number of leaves is identical
   # then roots also must be identical
   if new_size == old_size:
     return old_root == new_root
 
-  leaves = new_tree.leaves
+  levels = new_tree._levels
   index, paths = 0, []
 
   while old_size > 0:
-    # level is the largest power of two smaller than old_size
-    # log2(level) will indicate where we should be climbing
-    level = 2**(old_size.bit_length() - 1)
-    node = _climb_to(leaves[index], math.log(level, 2))
-    if node is None:
-      return False
-    paths.append(node)
-    index += level
-    old_size -= level
+    # height of the largest perfect subtree that fits into old_size,
+    # its root is right above the leaf at index on that level
+    height = old_size.bit_length() - 1
+    paths.append(levels[height][index >> height])
+    index += 1 << height
+    old_size -= 1 << height
 
   # if old_size is power of two (len(paths) == 1)
   # then we have our searched Merkle hash root
-  # otherwise we will need to concatenate all nodes
-  if len(paths) > 1:
-    paths = paths[::-1]
-    hasher = new_tree.hasher
-    concat = lambda a,b: _concat(hasher, a, b)
-    new_root = functools.reduce(concat, paths)
-  else:
-    new_root = paths[0].hash
+  # otherwise we will need to concatenate all subtree roots,
+  # starting from the smallest (rightmost) one
+  hash_children = new_tree.hasher.hash_children
+  new_root = paths.pop()
+  while len(paths) > 0:
+    new_root = hash_children(paths.pop(), new_root)
   return new_root == old_root
 
 
+def _unpack_proof(data, size):
+  """Splits a packed audit proof into (type, hash) pairs.
+
+  :param data: bytes produced by AuditProof.to_bytes.
+  :param size: the length of every hash in the proof.
+  :return: a list of (type, hash) tuples, hashes are memoryview slices.
+  """
+  view, stride = memoryview(data), size + 1
+  return [
+    (view[offset], view[offset + 1:offset + stride])
+    for offset in range(0, len(view), stride)
+  ]
+
+
+def _unpack_sides(bitmask, blob, size):
+  """Splits a proof packed by AuditProof.pack into (type, hash) pairs.
+
+  :param bitmask: bit i is set if the ith sibiling is on the left.
+  :param blob: the hashes of the proof, one after another.
+  :param size: the length of every hash in the proof.
+  :return: a list of (type, hash) tuples, hashes are memoryview slices.
+  """
+  view = memoryview(blob)
+  return [
+    (LEFT if (bitmask >> index) & 1 else RIGHT, view[offset:offset + size])
+    for index, offset in enumerate(range(0, len(view), size))
+  ]
+
+
+def _fold_sha256(hash, paths):
+  # the proof fold with hash_children inlined for the default hash
+  copy = _node_state.copy
+  for side, sibiling in paths:
+    state = copy()
+    if side == LEFT:
+      state.update(sibiling)
+      state.update(hash)
+    else:
+      state.update(hash)
+      state.update(sibiling)
+    hash = state.digest()
+  return hash
+
+
 def verify_leaf_inclusion(target, proof, hashobj, root_hash):
   """Verifies that a tree includes a leaf.
 
   :param target: a leaf which is represented by either a real object
     (int, str, etc.) or the hash value of that object.
   :param proof: a data structure that contains
-    AuditNode objects which serve to recreate the original Merkle hash root.
+    AuditNode objects which serve to recreate the original Merkle hash root,
+    or the same proof packed by AuditProof.to_bytes or AuditProof.pack.
   :param hashobj: a hash function or Hasher. If a hash function is provided,
     it will be used to convert a Hasher instance.
   :param root_hash: Merkle hash root provided by a trusted authority.
@@ -245,37 +421,47 @@ def verify_leaf_inclusion(target, proof, hashobj, root_hash):
 
   hasher = hashobj
   paths = None
+  root_hash = utils.from_hex(root_hash)
 
+  # a packed proof, every hash is as long as the root hash
+  if isinstance(proof, bytes_types):
+    paths = _unpack_proof(proof, len(root_hash))
+  # a (bitmask, blob) pair produced by AuditProof.pack
+  elif isinstance(proof, tuple) and len(proof) == 2 and isinstance(proof[0], int):
+    paths = _unpack_sides(proof[0], proof[1], len(root_hash))
   # any collection containing AuditNode objects.
-  if isinstance(proof, collections.abc.Iterable):
+  elif isinstance(proof, collections.abc.Iterable):
     if isinstance(proof[0], AuditNode):
-      paths = proof
+      paths = [(node.type, node.hash) for node in proof]
   elif isinstance(proof, AuditProof):
-    paths = proof._nodes
+    paths = [(node.type, node.hash) for node in proof._nodes]
 
   if paths is None:
     raise TypeError(
-      'Proof must be either <AuditProof>, '
-      'a collection of <AuditNode> objects.'
+      'Proof must be either <AuditProof>, bytes, a (bitmask, bytes) pair '
+      'or a collection of <AuditNode> objects.'
       )
-  # keep it dry
-  concat = lambda x,y: _concat(hasher, x, y)
-  def _calculate_root(target):
-    _proof = [target] + paths
-    return functools.reduce(concat, _proof)
-
-  new_root = _calculate_root(target)
-  root_hash = utils.from_hex(root_hash)
-  # try again if the user forgot to hash the target
-  if new_root != root_hash:
-    try:
-      new_root = _calculate_root(hasher.hash_leaf(target))
-    except:
-      pass
-  return new_root == root_hash
+  hash_children = hasher.hash_children
+  def _calculate_root(hash):
+    if hasher._hashfunc is _default_hash:
+      return _fold_sha256(hash, paths)
+    # a LEFT sibiling goes first, otherwise the current hash does
+    for side, sibiling in paths:
+      if side == LEFT:
+        hash = hash_children(sibiling, hash)
+      else:
+        hash = hash_children(hash, sibiling)
+    return hash
+
+  try:
+    return any(
+      _calculate_root(hash) == root_hash
+      for hash in _target_hashes(hasher, target)
+    )
+  except:
+    return False
 
 
-@six.add_metaclass(abc.ABCMeta)
 class _BaseNode(object):
   """Data structure that contains attributes common to all nodes.
 
@@ -291,12 +477,24 @@ class _BaseNode(object):
     self.hash = hash
     self.type = type
 
+  def combine_with(self, other, hasher):
+    """Hashes the node together with another node.
+
+    :param other: the sibiling of this node.
+    :param hasher: Hasher object for hashing nodes.
+    :return: the hash value of their parent.
+    """
+    # self.type == RIGHT or other.type == LEFT indicates other + self
+    if self.type == RIGHT or other.type == LEFT:
+      return hasher.hash_children(other.hash, self.hash)
+    return hasher.hash_children(self.hash, other.hash)
+
   def __eq__(self, other):
-    return all([
-      isinstance(other, _BaseNode),
-      self.hash == other.hash,
+    return (
+      isinstance(other, _BaseNode) and
+      self.hash == other.hash and
       self.type == other.type
-    ])
+    )
 
   def __repr__(self):
     name = type(self).__name__
@@ -309,7 +507,7 @@ class _BaseNode(object):
 class MerkleNode(_BaseNode):
   """Represents the leaves and nodes in a Merkle tree."""
 
-  __slots__ = ('left', 'right', 'parent',)
+  __slots__ = ('left', 'right', '_parent', '_type',)
 
   def __init__(self, hash, left=None, right=None, parent=None):
     # accept only non empty hashes
@@ -319,17 +517,42 @@ class MerkleNode(_BaseNode):
     self.left = left
     self.right = right
 
-    # if children nodes are not _empty
-    # automatically assign itself as their parent
-    if left and (left is not _empty):
+    # automatically assign itself as the parent of its children
+    if left is not None:
       left.parent = self
-    if right and (right is not _empty):
+    if right is not None:
       right.parent = self
     self.parent = parent
 
+  @property
+  def parent(self):
+    return self._parent
+
+  @parent.setter
+  def parent(self, parent):
+    self._parent = parent
+    # a side that has been assigned by hand
+    # only holds until the node is linked again
+    self._type = None
+
+  @property
+  def type(self):
+    if self._type is not None:
+      return self._type
+    # otherwise the side is derived from the parent on every access,
+    # so it follows the links even if they change after construction
+    parent = self._parent
+    if parent is None:
+      return UNKNOWN
+    return LEFT if (parent.left is self) else RIGHT
+
+  @type.setter
+  def type(self, type):
+    self._type = type
+
   @property
   def sibiling(self):
-    parent = self.parent
+    parent = self._parent
     if parent is None:
       return None
     if parent.left is self:
@@ -338,13 +561,6 @@ class MerkleNode(_BaseNode):
       return parent.left
     return None
 
-  @property
-  def type(self):
-    parent = self.parent
-    if parent is None:
-      return UNKNOWN
-    return LEFT if (parent.left is self) else RIGHT
-
   @classmethod
   def combine(cls, hasher, left, right):
     """Provided two nodes, create a parent node for them."""
@@ -364,26 +580,79 @@ class AuditProof(object):
   """Container of all AuditNode objects."""
 
   def __init__(self, nodes):
-    self._nodes = nodes
+    # frozen, __hash__ depends on the nodes
+    self._nodes = tuple(nodes)
+    self._hex_nodes = None
 
   @property
   def hex_nodes(self):
     # Convert all nodes to hexadecimal strings
-    if not hasattr(self, '_hex_nodes'):
+    if self._hex_nodes is None:
       self._hex_nodes = [
         utils.to_hex(n.hash) for n in self._nodes
       ]
     return self._hex_nodes
 
+  def to_bytes(self):
+    """Packs the proof into a single bytes object.
+
+    Every node is stored as one byte for its type followed by its hash.
+    """
+    return b''.join(bytes((n.type,)) + n.hash for n in self._nodes)
+
+  @classmethod
+  def from_bytes(cls, data, size=32):
+    """Restores a proof packed by to_bytes.
+
+    :param data: bytes produced by to_bytes.
+    :param size: the length of every hash in the proof.
+    """
+    return cls([
+      AuditNode(bytes(hash), type) for type, hash in _unpack_proof(data, size)
+    ])
+
+  def pack(self):
+    """Packs the proof into a bitmask of sides and a blob of hashes.
+
+    :return: a (bitmask, blob) tuple, bit i of the bitmask is set
+      if the ith node is a LEFT sibiling.
+    """
+    bitmask = 0
+    for index, node in enumerate(self._nodes):
+      if node.type == LEFT:
+        bitmask |= 1 << index
+    return bitmask, b''.join(n.hash for n in self._nodes)
+
+  @classmethod
+  def from_packed(cls, bitmask, blob, size=32):
+    """Restores a proof packed by pack.
+
+    :param bitmask: the bitmask of sides produced by pack.
+    :param blob: the hashes produced by pack.
+    :param size: the length of every hash in the proof.
+    """
+    return cls([
+      AuditNode(bytes(hash), type)
+      for type, hash in _unpack_sides(bitmask, blob, size)
+    ])
+
   def __len__(self):
     return len(self._nodes)
 
   def __eq__(self, other):
-    return all([
-      isinstance(other, AuditProof),
-      len(self) == len(other),
-      set(self.hex_nodes) == set(other.hex_nodes)
-    ])
+    if not isinstance(other, AuditProof):
+      return False
+    if len(self) != len(other):
+      return False
+    # order matters, the nodes are folded from the first to the last
+    return all(
+      a.hash == b.hash and a.type == b.type
+      for a, b in zip(self._nodes, other._nodes)
+    )
+
+  def __hash__(self):
+    # consistent with __eq__, the order and the sides count
+    return hash(tuple((n.hash, n.type) for n in self._nodes))
 
   def __repr__(self):
     items = ', '.join(self.hex_nodes)
@@ -411,6 +680,7 @@ class MerkleTree(object):
         It is either a hash function or a Hasher instance.
     """
     data = data or []
+    self._batching = False
     self._init_hashfunc(hashobj)
     self._build_tree(data)
 
@@ -427,22 +697,52 @@ class MerkleTree(object):
     # convert to a tuple if not iterable already
     if not isinstance(data, collections.abc.Iterable):
       data = (data, )
-    self._root = None
-    mapping = collections.OrderedDict()
     hasher = self._hasher
-    nodes = [MerkleNode(hasher.hash_leaf(item)) for item in data]
-    leaves = list(nodes)
-    # build the tree and compute the merkle hash root
-    while len(nodes) > 1:
-      if (len(nodes) % 2) != 0:
-        nodes.append(_empty)
-      nodes = [MerkleNode.combine(hasher, l, r) for l, r in _pairwise(nodes)]
-    if len(leaves) > 0:
-      # save all leaves
-      for leaf in leaves:
-        mapping[leaf.hash] = leaf
-      self._set_root(nodes[0])
-    self._mapping = mapping
+    # the tree is stored level by level as plain lists of hash values:
+    # _levels[0] holds the leaves and _levels[d + 1] holds the parents
+    # of every complete pair on _levels[d]. The parent of node i
+    # is i >> 1 on the level above, its sibiling is i ^ 1
+    level = hasher.hash_leaves(data)
+    levels = [level]
+    while len(level) > 1:
+      level = _hash_level(hasher, level)
+      levels.append(level)
+    self._levels = levels
+    self._spine = None
+    self._pending = None
+    self._cached_layer = None
+    # map the hash values of the leaves to their positions
+    self._mapping = {hash: index for index, hash in enumerate(levels[0])}
+    self._hex_root = self._hexleaves = None
+    if len(levels[0]) > 0:
+      self._root_changed()
+
+  def _update_spine(self):
+    if self._pending is not None:
+      self._hash_pending()
+    # nodes on the right edge of the tree that do not cover a full subtree
+    # are not stored in _levels, they are folded on demand from the
+    # trailing nodes of every level, which also yields the root
+    hash_children = self._hasher.hash_children
+    spine, carry = [], None
+    for level in self._levels:
+      spine.append(carry)
+      if (len(level) % 2) != 0:
+        # a node without a sibiling is promoted as is
+        last = level[-1]
+        carry = last if carry is None else hash_children(last, carry)
+    self._spine, self._root = spine, carry
+
+  def _iter_levels(self):
+    """Yields every level of the tree, including the spine nodes."""
+    root = self._root_hash
+    level = None
+    for level, partial in zip(self._levels, self._spine):
+      if partial is not None:
+        level = level + [partial]
+      yield level
+    if len(level) > 1:
+      yield [root]
 
   def get_proof(self, leaf):
     """Provides an audit proof for a leaf.
@@ -453,33 +753,70 @@ class MerkleTree(object):
       such that if traversed and concatenated,
       will produce the original merkle hash root
     """
-    mapping, hasher = self._mapping, self._hasher
+    mapping = self._mapping
     # assuming that leaf in hexadecimal representation
-    target = mapping.get(leaf)
-    if target is None:
-      target = mapping.get(hasher.hash_leaf(leaf))
+    index = mapping.get(leaf)
+    if index is None:
+      index = mapping.get(self._hasher.hash_leaf(leaf))
+    return self._get_proof(index)
+
+  def get_proof_by_hash(self, hash):
+    """Provides an audit proof for a leaf given its hash value.
+
+    :param hash: the hash value of a leaf, raw bytes or hexadecimal.
+    :return audit proof: same as get_proof.
+    """
+    return self._get_proof(self._mapping.get(utils.from_hex(hash)))
+
+  def get_proof_by_value(self, value):
+    """Provides an audit proof for a leaf given its original value.
+
+    :param value: a leaf object (int, str, etc.) that will be hashed.
+    :return audit proof: same as get_proof.
+    """
+    return self._get_proof(self._mapping.get(self._hasher.hash_leaf(value)))
+
+  def _get_proof(self, index):
     # no leaf in mapping, return an empty AuditProof object
-    if not isinstance(target, MerkleNode):
+    if index is None:
       return AuditProof([])
-    root, paths = self._root, []
-    # saving every sibiling node (if not _empty)
-    # until the root node is reached
-    while target is not root:
-      sibiling = target.sibiling
-      if sibiling is not _empty:
-        node = AuditNode(sibiling.hash, sibiling.type)
-        paths.append(node)
-      target = target.parent
+    if self._spine is None:
+      self._update_spine()
+    paths = []
+    # saving every sibiling node (if any)
+    # until the root level is reached
+    for level, partial in zip(self._levels, self._spine):
+      sibiling = index ^ 1
+      if sibiling < len(level):
+        hash = level[sibiling]
+      elif sibiling == len(level):
+        hash = partial
+      else:
+        hash = None
+      if hash is not None:
+        side = LEFT if (index & 1) else RIGHT
+        paths.append(AuditNode(hash, side))
+      index >>= 1
     return AuditProof(paths)
 
-  def _rehash(self, node):
-    root, hasher = self._root, self._hasher
-    # rehash nodes all the way to the root
-    while node is not root:
-      parent = node.parent
-      sibiling = node.sibiling
-      parent.hash = _concat(hasher, node, sibiling)
-      node = parent
+  def _rehash(self, index):
+    levels, hash_children = self._levels, self._hasher.hash_children
+    # rehash complete nodes all the way up,
+    # the spine will be folded again once needed
+    for depth in range(len(levels) - 1):
+      parents = levels[depth + 1]
+      if (index >> 1) >= len(parents):
+        break
+      level = levels[depth]
+      sibiling = index ^ 1
+      if index & 1:
+        hash = hash_children(level[sibiling], level[index])
+      else:
+        hash = hash_children(level[index], level[sibiling])
+      index >>= 1
+      parents[index] = hash
+    self._spine = None
+    self._root_changed()
 
   def update(self, old, new):
     """Updates a leaf.
@@ -497,15 +834,15 @@ class MerkleTree(object):
       )
     mapping, hasher = self._mapping, self._hasher
     # first, assuming leaves are hash values in hex
-    leaf = mapping.get(utils.from_hex(old))
-    if leaf is None:
-      leaf = mapping.get(hasher.hash_leaf(old))
+    index = mapping.get(utils.from_hex(old))
+    if index is None:
+      index = mapping.get(hasher.hash_leaf(old))
       new = hasher.hash_leaf(new)
     # raise the error if the leaf's not found
-    if not isinstance(leaf, MerkleNode):
+    if index is None:
       raise KeyError('Invalid old value.')
-    leaf.hash = utils.from_hex(new)
-    self._rehash(leaf)
+    self._levels[0][index] = utils.from_hex(new)
+    self._rehash(index)
 
   def append(self, item):
     """Appends a new leaf to the end of the tree.
@@ -513,55 +850,38 @@ class MerkleTree(object):
     :param item: item to be added to the tree.
     Note: this will hash the item!
     """
-    mapping, hasher, leaves, root = (
-      self._mapping,
-      self._hasher,
-      self.leaves,
-      self._root
-    )
-    # build first merkle root
-    if len(leaves) == 0:
-      root = MerkleNode(hasher.hash_leaf(item))
-      mapping[root.hash] = root
-      self._set_root(root)
-      return
-
-    last = leaves[-1]
+    levels, hasher = self._levels, self._hasher
     new_hash = hasher.hash_leaf(item)
-    node = mapping[new_hash] = MerkleNode(new_hash)
-    # only one leaf is present
-    if last is root:
-      root = MerkleNode.combine(hasher, root, node)
-      self._set_root(root)
-      return
-
-    sibiling = last.sibiling
-    connector = last.parent
-    # replace _empty with a real node
-    if sibiling is _empty:
-      node.parent = connector
-      connector.right = node
-      self._rehash(node)
+    level = levels[0]
+    self._mapping[new_hash] = len(level)
+    if self._batching:
+      # the pairs are hashed together once the batch is over
+      if self._pending is None:
+        self._pending = len(level)
+      level.append(new_hash)
+      self._spine = None
+      self._root_changed()
       return
-    # build up a subtree until we find a node to which we can connect
-    node.right = _empty
-    while connector is not root:
-      node = MerkleNode.combine(hasher, node, _empty)
-      sibiling = connector.sibiling
-      # we've found the node to which we can hook up the new subtree
-      if sibiling is _empty:
-        connector.parent.right = node
-        node.parent = connector.parent
-        self._rehash(node)
-        return
-      connector = connector.parent
-    node = MerkleNode.combine(hasher, node, _empty)
-    self._set_root(MerkleNode.combine(hasher, connector, node))
-
-  def _set_root(self, new_root):
+    level.append(new_hash)
+    # every time a level gets a complete pair, the pair moves up
+    # (similar to carrying bits when incrementing a binary counter)
+    # so appending takes a single hash on average
+    depth = 0
+    while (len(level) % 2) == 0:
+      depth += 1
+      if depth == len(levels):
+        levels.append([])
+      parents = levels[depth]
+      parents.append(hasher.hash_children(level[-2], level[-1]))
+      level = parents
+    self._spine = None
+    self._root_changed()
+
+  def _root_changed(self):
     # record the time when the root has been created/changed
-    self._root = new_root
     self.last_changed = time.time()
+    # hexadecimal forms are memoized until the next change
+    self._hex_root = self._hexleaves = None
 
   def extend(self, data):
     """Extends the tree by adding additional leaves.
@@ -572,28 +892,101 @@ class MerkleTree(object):
       data = data.leaves
     elif not isinstance(data, collections.abc.Iterable):
       data = (data, data)
-    # traverse and append each item
-    for item in data:
-      self.append(item)
+    levels, hasher = self._levels, self._hasher
+    hashes = hasher.hash_leaves(data)
+    if len(hashes) == 0:
+      return
+    level, mapping = levels[0], self._mapping
+    if self._pending is None:
+      self._pending = len(level)
+    for index, hash in enumerate(hashes, len(level)):
+      mapping[hash] = index
+    level.extend(hashes)
+    if not self._batching:
+      self._hash_pending()
+    self._spine = None
+    self._root_changed()
+
+  def _hash_pending(self):
+    levels, hasher = self._levels, self._hasher
+    level, start = levels[0], self._pending
+    self._pending = None
+    # hash the new complete pairs level by level, one batch per level,
+    # a pair is new if it ends past the old length of that level
+    depth = 0
+    while True:
+      pairs = level[start & ~1:len(level) & ~1]
+      if len(pairs) == 0:
+        break
+      depth += 1
+      if depth == len(levels):
+        levels.append([])
+      parents = levels[depth]
+      start = len(parents)
+      parents.extend(hasher.hash_children_batch(_pairwise(pairs)))
+      level = parents
+
+  @contextlib.contextmanager
+  def batch(self):
+    """Defers hashing of the appended leaves until the block is over.
+
+    Usage::
+      >>> with tree.batch():
+      ...   for item in items:
+      ...     tree.append(item)
+
+    Pairs completed by the new leaves are then hashed a level at a time,
+    as extend does. Reading the root or a proof inside the block
+    still works, it hashes the pending leaves first.
+    """
+    batching, self._batching = self._batching, True
+    try:
+      yield self
+    finally:
+      self._batching = batching
+      if not batching and self._pending is not None:
+        self._hash_pending()
 
   @property
   def leaves(self):
     """Returns MerkleNode instances that
-     represent the leaves of the tree."""
-    return list(self._mapping.values())
+     represent the leaves of the tree.
+
+    The tree only stores hash values, so the nodes (and their parents
+    up to the root) are built on every access. They are linked the same
+    way as the tree, yet changing them does not change the tree.
+    """
+    levels = self._iter_levels()
+    nodes = leaves = [MerkleNode(hash) for hash in next(levels)]
+    for level in levels:
+      # a lone node is promoted, its parent has it as the only child
+      nodes = [
+        MerkleNode(hash, *nodes[index << 1:(index + 1) << 1])
+        for index, hash in enumerate(level)
+      ]
+    return leaves
 
   @property
   def hexleaves(self):
     """Returns the leaves of the tree as hexadecimal strings."""
-    convert = lambda n: utils.to_hex(n.hash)
-    return list(map(convert, self._mapping.values()))
+    if self._hexleaves is None:
+      self._hexleaves = list(map(utils.to_hex, self._levels[0]))
+    return list(self._hexleaves)
+
+  @property
+  def _root_hash(self):
+    if self._spine is None:
+      self._update_spine()
+    return self._root
 
   @property
   def merkle_root(self):
-    root = self._root
-    if root is None:
-      return None
-    return utils.to_hex(root.hash)
+    if self._hex_root is None:
+      root = self._root_hash
+      if root is None:
+        return None
+      self._hex_root = utils.to_hex(root)
+    return self._hex_root
 
   @property
   def hasher(self):
@@ -623,24 +1016,87 @@ class MerkleTree(object):
       self.merkle_root
     )
 
+  def cache_layer(self, height):
+    """Stores a snapshot of one level to shorten later proof checks.
+
+    The snapshot is pinned to the tree as it is now: later updates and
+    appends do not change it, so proofs taken now keep verifying against
+    it until cache_layer is called again. Rebuilding or clearing the
+    tree drops it.
+    :param height: the level to cache, counting from the leaves (0).
+    """
+    levels = list(self._iter_levels())
+    if not 0 <= height < len(levels):
+      raise ValueError(f'Invalid height: {height}')
+    # _iter_levels yields the stored lists themselves, copy the level
+    self._cached_layer = (height, len(self), list(levels[height]))
+
+  def verify_leaf_inclusion_cached(self, target, proof, index):
+    """Verifies that a leaf is included using the layer stored by cache_layer.
+
+    Only the proof nodes below the cached layer are hashed, the result
+    is compared with the cached node instead of the merkle root.
+    :param target: a leaf which is represented by either a real object
+      (int, str, etc.) or the hash value of that object.
+    :param proof: an AuditProof or a collection of AuditNode objects,
+      either the full proof of the leaf or just its prefix.
+    :param index: the position of the leaf in the tree.
+    :return: True if the leaf is included in the tree.
+    """
+    if self._cached_layer is None:
+      raise ValueError('No layer cached, call cache_layer first.')
+    height, size, layer = self._cached_layer
+    nodes = proof._nodes if isinstance(proof, AuditProof) else proof
+    if not 0 <= index < size:
+      return False
+    hash_children = self._hasher.hash_children
+    def _calculate_node(hash):
+      position, paths = index, iter(nodes)
+      for depth in range(height):
+        # a sibiling exists if it falls within the (partial) level
+        if (position ^ 1) <= (size - 1) >> depth:
+          node = next(paths, None)
+          if node is None:
+            return None
+          if node.type == LEFT:
+            hash = hash_children(node.hash, hash)
+          else:
+            hash = hash_children(hash, node.hash)
+        position >>= 1
+      return hash
+    expected = layer[index >> height]
+    # a target is read the same way as in verify_leaf_inclusion
+    return any(
+      _calculate_node(hash) == expected
+      for hash in _target_hashes(self._hasher, target)
+    )
+
   def clear(self):
     # clear all nodes and leaves
-    self._root = None
+    self._levels = [[]]
+    self._spine = self._pending = None
+    self._cached_layer = None
+    self._hex_root = self._hexleaves = None
     self._mapping.clear()
 
   def __len__(self):
     """Returns the number of leaves in the tree."""
-    return len(self._mapping)
+    return len(self._levels[0])
 
   def __eq__(self, other):
     """Checks if the trees are identical."""
-    root_hash = self._root.hash
+    if self is other:
+      return True
     if isinstance(other, MerkleTree):
-      other_root_hash = utils.from_hex(other.merkle_root)
+      # trees of different sizes can't be identical,
+      # otherwise comparing the roots is enough
+      if len(self) != len(other):
+        return False
+      other_root_hash = other._root_hash
     else:
-      other = utils.to_string(other)
+      # either a digest or a hexadecimal string
       other_root_hash = utils.from_hex(other)
-    return root_hash == other_root_hash
+    return self._root_hash == other_root_hash
 
   def __ge__(self, other):
     """Verifies that the tree contains the same nodes
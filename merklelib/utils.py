@@ -1,6 +1,5 @@
-from merklelib.compat import bytes, str, bytes_types, is_py2
+from merklelib.compat import bytes, str, bytes_types
 
-import codecs
 import binascii
 
 
@@ -12,28 +11,21 @@ def to_string(value):
     if isinstance(value, bytes_types):
         return value
     elif isinstance(value, str):
-        if not is_py2:
-            value = value.encode()
-        return value
+        return value.encode()
     else:
-        value = str(value)
-        if not is_py2:
-            value = value.encode()
-        return bytes(value)
+        return str(value).encode()
 
 
 def to_hex(value):
-    if not is_py2:
-        return to_string(value).hex()
-    return codecs.encode(to_string(value), "hex")
+    return to_string(value).hex()
 
 
 def from_hex(value):
+    # raw digests do not need any decoding
+    if isinstance(value, bytes_types):
+        return value
     try:
-        if not is_py2:
-            # this seems to be faster in Python 3
-            return bytes.fromhex(value)
-        return bytes(bytearray.fromhex(value))
+        return bytes.fromhex(value)
     except Exception as error:
         if isinstance(error, binascii.Error):
             raise
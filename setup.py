@@ -16,7 +16,7 @@ description = 'Merkle tree and its variations for easier data verification.'
 url = 'https://github.com/vpaliy/merkle-trees'
 email = 'vpaliy97@gmail.com'
 author = 'Vasyl Paliy'
-requires_python = '>=2.7'
+requires_python = '>=3.6'
 license = 'MIT'
 version = None
 
@@ -35,8 +35,7 @@ try:
     requires = [r.strip() for r in fp.readlines()]
 except FileNotFoundError:
     requires = [
-      'six',
-      'future-strings'
+      'anytree'
     ]
 
 class UploadCommand(Command):
@@ -90,8 +89,6 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
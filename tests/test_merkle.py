@@ -1,7 +1,5 @@
-# -*- coding: future_fstrings -*-
 import collections
 import hashlib
-import math
 import string
 import unittest
 
@@ -10,7 +8,12 @@ try:
 except ImportError:
     import mock
 
-from random import choice
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+from random import getrandbits
 
 from merklelib.merkle import (
     Hasher,
@@ -26,8 +29,11 @@ from merklelib.merkle import (
 )
 
 
+_sha256 = hashlib.sha256
+
+
 def hashfunc(x):
-    return hashlib.sha256(x).digest()
+    return _sha256(x).digest()
 
 
 # used for side effects
@@ -35,64 +41,111 @@ def mirror(x):
     return x
 
 
-# Adding __dict__ would allow to mock prototype methods
-class MerkleNode(MerkleNode):
-    __slots__ = ('__dict__',)
-
-
-def patchdescriptor(cls, method, new):
-    if not hasattr(cls, method):
-        raise RuntimeError(f'{method} not found')
-
-    def _patchdescriptor(func):
-        def _wrapper(*args, **kwargs):
-            try:
-                current = getattr(cls, method)
-                setattr(cls, method, new)
-                result = func(*args, **kwargs)
-            finally:
-                setattr(cls, method, current)
-
-        return _wrapper
-
-    return _patchdescriptor
-
-
 def _calculate_root(nodes):
     hasher = Hasher(hashfunc)
+    nodes = list(nodes)
     while len(nodes) > 1:
+        # an unpaired node is promoted to the next level as it is
+        parents = [hasher.hash_children(l, r) for l, r in zip(nodes[::2], nodes[1::2])]
         if len(nodes) % 2 != 0:
-            nodes.append(nodes[-1])
-        a = iter(nodes)
-        nodes = []
-        for l, r in zip(a, a):
-            hashval = l
-            if hashval != r:
-                hashval = hasher.hash_children(l, r)
-            nodes.append(hashval)
+            parents.append(nodes[-1])
+        nodes = parents
     return nodes[0]
 
 
+def _calculate_prefix_roots(nodes):
+    hasher = Hasher(hashfunc)
+    roots, stack = [], []
+    for node in nodes:
+        # merge perfect subtrees of equal height, like a binary carry
+        height = 0
+        while stack and stack[-1][0] == height:
+            node = hasher.hash_children(stack.pop()[1], node)
+            height += 1
+        stack.append((height, node))
+        root = stack[-1][1]
+        for _, left in reversed(stack[:-1]):
+            root = hasher.hash_children(left, root)
+        roots.append(root)
+    return roots
+
+
 # commonly used objects across tests
 hasher = Hasher(hashfunc)
 leaf = b'765f15d171871b00034ee55e48f'
 
 to_hex = mock.patch('merklelib.utils.to_hex', side_effect=mirror)
-to_hex.start()
+
+
+def setUpModule():
+    to_hex.start()
+
+
+def tearDownModule():
+    to_hex.stop()
 
 
 class MerkleTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # shared by the tests that only read from a tree
+        cls.tree = MerkleTree(string.ascii_letters)
+        # expected roots of every prefix, indexed by its size
+        hashes = hasher.hash_leaves(string.ascii_letters)
+        cls.prefix_roots = [None] + _calculate_prefix_roots(hashes)
+
     def test_hasher(self):
         children = leaf * 2
         classname = hasher.__class__.__name__
 
         self.assertEqual(hasher.hash_leaf(leaf), hashfunc(b'\x00' + leaf))
         self.assertEqual(hasher.hash_children(leaf, leaf), hashfunc(b'\x01' + children))
+        self.assertEqual(hasher.hash_leaves([leaf, leaf]), [hasher.hash_leaf(leaf)] * 2)
+        self.assertEqual(hasher.hash_children_batch([(leaf, leaf)]), [hasher.hash_children(leaf, leaf)])
         self.assertNotEqual(hasher.hashfunc, hashfunc)
         self.assertEqual(hasher.hashfunc.__wrapped__, hashfunc)
         self.assertEqual(str(hasher), f'{classname}({hashfunc})')
         self.assertEqual(repr(hasher), f'{classname}({hashfunc})')
 
+        # constructing a Hasher does not call the hash function
+        counted = mock.Mock(side_effect=hashfunc)
+        Hasher(counted)
+        counted.assert_not_called()
+
+        # hexadecimal digests are decoded, raw ones are used as they are
+        hexhasher = Hasher(lambda x: hashlib.sha256(x).hexdigest())
+        self.assertEqual(hexhasher.hash_leaf(leaf), hasher.hash_leaf(leaf))
+        self.assertEqual(hexhasher.hash_children(leaf, leaf), hasher.hash_children(leaf, leaf))
+
+        accelerations = Hasher.available_accelerations()
+        self.assertEqual(set(accelerations), {'openssl', 'sha_ni', 'blake3'})
+        with mock.patch('builtins.open', side_effect=AssertionError):
+            self.assertEqual(Hasher.available_accelerations(), accelerations)
+        self.assertEqual(Hasher.from_algorithm('sha256').hash_leaf(leaf), hasher.hash_leaf(leaf))
+        self.assertEqual(Hasher.from_algorithm().hash_leaf(leaf), hasher.hash_leaf(leaf))
+        self.assertIsInstance(Hasher.from_algorithm('auto'), Hasher)
+        self.assertRaises(ValueError, Hasher.from_algorithm, 'invalid')
+
+        # the default hash function still accepts any object
+        self.assertEqual(Hasher().hashfunc('abc'), hashfunc(b'abc'))
+        self.assertEqual(Hasher().hashfunc(5), hashfunc(b'5'))
+
+    @unittest.skipIf(blake3 is None, 'blake3 is not installed')
+    def test_hasher_blake3(self):
+        blake3_hasher = Hasher.from_algorithm('blake3')
+        lefthash, righthash = hashfunc(leaf), hashfunc(leaf[::-1])
+
+        self.assertEqual(blake3_hasher.hash_leaf(leaf), blake3.blake3(b'\x00' + leaf).digest())
+        self.assertEqual(
+            blake3_hasher.hash_children(lefthash, righthash),
+            blake3.blake3(b'\x01' + lefthash + righthash).digest()
+        )
+        self.assertEqual(
+            blake3_hasher.hash_leaf(leaf),
+            Hasher.from_algorithm('auto').hash_leaf(leaf)
+        )
+        self.assertEqual(blake3_hasher.hashfunc('abc'), blake3.blake3(b'abc').digest())
+
     def test_merkle_node(self):
         hashval = hashfunc(leaf)
 
@@ -111,7 +164,15 @@ class MerkleTestCase(unittest.TestCase):
         self.assertEqual(node.type, UNKNOWN)
         self.assertIsNone(node.sibiling)
 
-    @patchdescriptor(MerkleNode, 'type', UNKNOWN)
+        # nodes linked after construction follow their parent
+        child = MerkleNode(hashval, parent=node)
+        node.left = child
+        self.assertEqual(child.type, LEFT)
+        self.assertEqual(child.sibiling, right)
+        left.parent = None
+        self.assertEqual(left.type, UNKNOWN)
+        self.assertIsNone(left.sibiling)
+
     def test_merkle_node_combine(self):
         lefthash = hashfunc(b'\x01' + leaf)
         righthash = hashfunc(b'\x02' + leaf)
@@ -128,6 +189,7 @@ class MerkleTestCase(unittest.TestCase):
             self.assertEqual(right.sibiling, left)
 
         _assert_all(hasher.hash_children(lefthash, righthash))
+        self.assertEqual(left.combine_with(right, hasher), node.hash)
 
         # testing concat(right, left)
         left.type = RIGHT;
@@ -137,14 +199,17 @@ class MerkleTestCase(unittest.TestCase):
         _assert_all(hasher.hash_children(righthash, lefthash))
 
         # another case of concat(right, left)
-        left.type = LEFT
+        # combine() has just assigned both sides again
+        left.type, right.type = LEFT, LEFT
         node = MerkleNode.combine(hasher, left, right)
 
         _assert_all(hasher.hash_children(righthash, lefthash))
 
     def test_audit_proof(self):
         hashes = list(string.ascii_letters)
-        nodes = [AuditNode(hash, choice([LEFT, RIGHT])) for hash in hashes]
+        # one random bit per node picks its side
+        sides = getrandbits(len(hashes))
+        nodes = [AuditNode(hash, RIGHT if (sides >> i) & 1 else LEFT) for i, hash in enumerate(hashes)]
 
         proof = AuditProof(nodes)
         items = ', '.join(hashes)
@@ -154,9 +219,34 @@ class MerkleTestCase(unittest.TestCase):
         self.assertEqual(repr(proof), items_str)
         self.assertEqual(str(proof), items_str)
 
+        # proofs are folded in order, so order is part of equality
+        self.assertEqual(proof, AuditProof(list(nodes)))
+        self.assertNotEqual(proof, AuditProof(nodes[::-1]))
+        self.assertNotEqual(proof, nodes)
+        self.assertEqual(len({proof, AuditProof(list(nodes))}), 1)
+
+    def test_audit_proof_bytes(self):
+        tree = MerkleTree(string.ascii_letters, hasher)
+        merkle_root = tree.merkle_root
+
+        for leaf in string.ascii_letters:
+            proof = tree.get_proof(leaf)
+            packed = proof.to_bytes()
+
+            self.assertEqual(len(packed), len(proof) * 33)
+            self.assertEqual(AuditProof.from_bytes(packed), proof)
+            self.assertTrue(verify_leaf_inclusion(leaf, packed, hashfunc, merkle_root))
+            self.assertFalse(verify_leaf_inclusion('invalid', packed, hashfunc, merkle_root))
+
+            bitmask, blob = proof.pack()
+            self.assertEqual(len(blob), len(proof) * 32)
+            self.assertEqual(AuditProof.from_packed(bitmask, blob), proof)
+            self.assertTrue(verify_leaf_inclusion(leaf, (bitmask, blob), hashfunc, merkle_root))
+            self.assertFalse(verify_leaf_inclusion('invalid', (bitmask, blob), hashfunc, merkle_root))
+
     def test_merkle_tree_init(self):
         leaves = list(string.ascii_letters)
-        hashes = [hasher.hash_leaf(leaf) for leaf in leaves]
+        hashes = hasher.hash_leaves(leaves)
 
         # testing _init_hashfunc
         self.assertRaises(TypeError, MerkleTree, leaves, leaves)
@@ -172,11 +262,23 @@ class MerkleTestCase(unittest.TestCase):
         self.assertEqual(tree.hexleaves, hashes)
         self.assertEqual(tree.merkle_root, _calculate_root(hashes))
 
+        # leaves are linked to their parents up to the root
+        node = tree.leaves[0]
+        self.assertEqual(node.sibiling.hash, hashes[1])
+        while node.parent is not None:
+            node = node.parent
+        self.assertEqual(node.hash, tree.merkle_root)
+
         # converting non iterable leaves to tuples
         tree = MerkleTree('a', hasher)
         self.assertEqual(tree.hexleaves, [hasher.hash_leaf('a')])
         self.assertEqual(tree.merkle_root, hasher.hash_leaf('a'))
 
+        # memoized values are dropped once the tree changes
+        tree.append('b')
+        self.assertEqual(tree.hexleaves, [hasher.hash_leaf('a'), hasher.hash_leaf('b')])
+        self.assertNotEqual(tree.merkle_root, hasher.hash_leaf('a'))
+
         # test case for empty root
         tree = MerkleTree()
         self.assertEqual(tree.hexleaves, [])
@@ -187,23 +289,23 @@ class MerkleTestCase(unittest.TestCase):
         tree = MerkleTree(chars, hasher)
 
         self.assertEqual(tree.get_proof('invalid'), AuditProof([]))
+        self.assertEqual(tree.get_proof_by_hash(b'invalid'), AuditProof([]))
+        self.assertEqual(tree.get_proof_by_value('invalid'), AuditProof([]))
 
         # proof should contain log2 (n) of nodes
-        for char in chars:
-            expected = math.ceil(math.log(len(chars), 2))
+        expected = (len(chars) - 1).bit_length()
+        for char, hashval in zip(chars, hasher.hash_leaves(chars)):
             # check for simple chars
             proof = tree.get_proof(char)
             self.assertEqual(len(proof), expected)
             # check for hashed leaves
-            proof = tree.get_proof(hasher.hash_leaf(char))
+            proof = tree.get_proof(hashval)
             self.assertEqual(len(proof), expected)
 
     def test_merkle_tree_update(self):
         chars = string.ascii_letters
-        hash_mapping = collections.OrderedDict()
-
-        for char in chars:
-            hash_mapping[char] = hasher.hash_leaf(char)
+        leaf_hashes = dict(zip(chars, hasher.hash_leaves(chars)))
+        hash_mapping = collections.OrderedDict(leaf_hashes)
 
         tree = MerkleTree(chars, hasher)
         initial_merkle_root = tree.merkle_root
@@ -216,7 +318,7 @@ class MerkleTestCase(unittest.TestCase):
 
         for a, b in zip(chars, chars[::-1]):
             prev_merkle_root = current_root
-            hash_mapping[a] = hasher.hash_leaf(b)
+            hash_mapping[a] = leaf_hashes[b]
 
             # swap values
             tree.update(a, b)
@@ -229,7 +331,7 @@ class MerkleTestCase(unittest.TestCase):
             self.assertEqual(tree.merkle_root, current_root)
 
             # same thing for hash values for leaves
-            tree.update(hasher.hash_leaf(a), hasher.hash_leaf(b))
+            tree.update(leaf_hashes[a], leaf_hashes[b])
 
             self.assertNotEqual(tree.merkle_root, initial_merkle_root)
             self.assertNotEqual(tree.merkle_root, prev_merkle_root)
@@ -237,7 +339,7 @@ class MerkleTestCase(unittest.TestCase):
 
     def test_merkle_tree_append(self):
         ascii = string.ascii_letters
-        hashes = [hasher.hash_leaf(char) for char in ascii]
+        hashes = hasher.hash_leaves(ascii)
 
         tree = MerkleTree(hashobj=hasher)
 
@@ -256,22 +358,47 @@ class MerkleTestCase(unittest.TestCase):
         self.assertEqual(len(tree), len(ascii))
         self.assertEqual(tree.merkle_root, expected_hash)
 
-        # test all cases
-        for limit in range(1, len(ascii)):
-            tree.clear()
-            tree.extend(ascii[:limit])
-            expected_hash = _calculate_root(hashes[:limit])
+        # test all cases, growing a single tree
+        tree.clear()
+        prefix_roots = _calculate_prefix_roots(hashes)
+        self.assertEqual(prefix_roots[-1], expected_hash)
+        for limit, (char, expected_hash) in enumerate(zip(ascii, prefix_roots), 1):
+            tree.append(char)
 
             self.assertEqual(len(tree), limit)
             self.assertEqual(tree.merkle_root, expected_hash)
 
+            # proofs must hold for trees that were built incrementally
+            for char in ascii[:limit]:
+                proof = tree.get_proof(char)
+                self.assertTrue(tree.verify_leaf_inclusion(char, proof))
+
+        # appending in a batch defers hashing, not the result
+        tree.clear()
+        with tree.batch():
+            for char in ascii:
+                tree.append(char)
+            self.assertEqual(len(tree), len(ascii))
+        self.assertEqual(tree.merkle_root, _calculate_root(hashes))
+
+        # extending a non-empty tree in chunks
+        expected_hash = _calculate_root(hashes)
+        for size in range(1, 8):
+            tree.clear()
+            for start in range(0, len(ascii), size):
+                tree.extend(ascii[start:start + size])
+            self.assertEqual(tree.merkle_root, expected_hash)
+
     def test_merkle_tree_equals(self):
         a = MerkleTree(string.ascii_letters)
         b = MerkleTree(string.ascii_letters)
 
         self.assertEqual(a, b)
+        self.assertEqual(a, a)
         self.assertTrue(a.__eq__(b))
         self.assertTrue(b.__eq__(a))
+        self.assertTrue(a.__eq__(b._root_hash))
+        self.assertFalse(a.__eq__(MerkleTree(string.ascii_letters[1:])))
 
         a.append(1)
         b.append(2)
@@ -287,23 +414,61 @@ class MerkleTestCase(unittest.TestCase):
         tree = MerkleTree(string.ascii_letters, hasher)
         merkle_root = tree.merkle_root
 
-        for leaf in string.ascii_letters:
+        leaves = string.ascii_letters
+        for leaf, hashval in zip(leaves, hasher.hash_leaves(leaves)):
             proof = tree.get_proof(leaf)
-            hashval = hasher.hash_leaf(leaf)
 
             self.assertEqual(tree.get_proof(hashval), proof)
+            self.assertEqual(tree.get_proof_by_hash(hashval), proof)
+            self.assertEqual(tree.get_proof_by_value(leaf), proof)
             self.assertTrue(verify_leaf_inclusion(leaf, proof, hashfunc, merkle_root))
 
+        # the default hash function is folded by a specialised loop
+        tree = self.tree
+        for leaf in string.ascii_letters:
+            proof = tree.get_proof(leaf)
+            self.assertTrue(tree.verify_leaf_inclusion(leaf, proof))
+            self.assertFalse(tree.verify_leaf_inclusion('invalid', proof))
+
+    def test_verify_leaf_inclusion_cached(self):
+        tree = MerkleTree(string.ascii_letters, hasher)
+        self.assertRaises(ValueError, tree.verify_leaf_inclusion_cached, 'a', [], 0)
+        self.assertRaises(ValueError, tree.cache_layer, -1)
+
+        for height in range(3):
+            tree.cache_layer(height)
+            for index, leaf in enumerate(string.ascii_letters):
+                proof = tree.get_proof(leaf)
+                self.assertTrue(tree.verify_leaf_inclusion_cached(leaf, proof, index))
+                self.assertFalse(tree.verify_leaf_inclusion_cached('invalid', proof, index))
+
+        # the cached layer is a snapshot, later updates do not change it
+        tree = MerkleTree('abcd', hasher)
+        tree.cache_layer(1)
+        proof = tree.get_proof('a')
+        tree.update('a', 'z')
+        self.assertTrue(tree.verify_leaf_inclusion_cached('a', proof, 0))
+
+        # objects other than hash values are only folded once hashed as leaves
+        with mock.patch.object(tree.hasher, 'hash_children', wraps=tree.hasher.hash_children) as spy:
+            self.assertFalse(tree.verify_leaf_inclusion_cached('invalid', proof, 0))
+            self.assertEqual(spy.call_count, 1)
+
+        # clearing the tree drops the snapshot
+        tree.clear()
+        tree.extend(['x', 'y'])
+        self.assertRaises(ValueError, tree.verify_leaf_inclusion_cached, 'a', proof, 0)
+
     def test_verify_tree_consistency(self):
         self.assertRaises(TypeError, verify_tree_consistency)
         self.assertFalse(verify_tree_consistency(MerkleTree(), None, 10))
 
-        tree = MerkleTree(string.ascii_letters)
+        tree = self.tree
         merkle_root = tree.merkle_root
 
         self.assertTrue(verify_tree_consistency(tree, merkle_root, len(tree)))
+        self.assertEqual(MerkleTree(string.ascii_letters[:10]).merkle_root, self.prefix_roots[10])
 
         for size in range(1, len(tree)):
-            old_tree = MerkleTree(string.ascii_letters[:size])
-            merkle_root = old_tree.merkle_root
+            merkle_root = self.prefix_roots[size]
             self.assertTrue(verify_tree_consistency(tree, merkle_root, size))